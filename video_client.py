@@ -1,11 +1,29 @@
 import cv2
+import queue
+import signal
 import socket
 import struct
+import threading
 import time
 import numpy as np
 
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420
+except ImportError:
+    TurboJPEG = None
+
+# Frame size prefix sent ahead of every JPEG payload
+FRAME_HEADER = struct.Struct('!I')
+
+# Explicit socket buffer size (~1 MB) so several frames fit in flight
+SOCKET_BUFFER_SIZE = 1 << 20
+
+# Characters that can appear in the timestamp / frame counter overlays
+OVERLAY_CHARS = "0123456789:- Frame"
+
 class VideoClient:
-    def __init__(self, server_host='localhost', server_port=8080, camera_index=0):
+    def __init__(self, server_host='localhost', server_port=8080, camera_index=0,
+                 show_preview=False, frame_size=(480, 360), jpeg_quality=60):
         """
         Initialize video client
         
@@ -13,20 +31,66 @@ class VideoClient:
             server_host (str): Server host address
             server_port (int): Server port
             camera_index (int): Camera device index
+            show_preview (bool): Show a local preview window
+            frame_size (tuple): (width, height) frames are scaled to before sending
+            jpeg_quality (int): JPEG quality used for the stream (0-100)
         """
         self.server_host = server_host
         self.server_port = server_port
         self.camera_index = camera_index
+        self.show_preview = show_preview
+        self.frame_size = tuple(frame_size)
+        self.jpeg_quality = jpeg_quality
         self.socket = None
         self.cap = None
         self.running = False
+        # Reused size header; only the sender thread packs into it
+        self.header_buf = bytearray(FRAME_HEADER.size)
+        
+        # Pre-rendered overlay glyphs, composited by lookup instead of putText
+        self.glyphs, self.glyph_height = self.build_glyphs(OVERLAY_CHARS)
+        
+        # libjpeg-turbo encoder (falls back to OpenCV when unavailable)
+        self.tj = None
+        if TurboJPEG is not None:
+            try:
+                self.tj = TurboJPEG()
+            except (OSError, RuntimeError) as e:
+                print(f"⚠️ libjpeg-turbo unavailable, using OpenCV encoder: {e}")
         
+    @staticmethod
+    def build_glyphs(chars, scale=0.7, thickness=2, color=(0, 255, 0)):
+        """Render each character once into a BGR tile of common height"""
+        font = cv2.FONT_HERSHEY_SIMPLEX
+        (_, height), baseline = cv2.getTextSize(chars, font, scale, thickness)
+        glyphs = {}
+        for ch in set(chars):
+            (width, _), _ = cv2.getTextSize(ch, font, scale, thickness)
+            tile = np.zeros((height + baseline, width, 3), dtype=np.uint8)
+            cv2.putText(tile, ch, (0, height), font, scale, color, thickness)
+            glyphs[ch] = tile
+        return glyphs, height
+    
+    def render_text(self, text):
+        """Assemble a text strip from the glyph atlas"""
+        return np.hstack([self.glyphs[ch] for ch in text])
+    
+    def draw_text(self, frame, strip, x, baseline_y):
+        """Copy a text strip into the frame with its baseline at baseline_y"""
+        y = max(baseline_y - self.glyph_height, 0)
+        h = min(strip.shape[0], frame.shape[0] - y)
+        w = min(strip.shape[1], frame.shape[1] - x)
+        frame[y:y + h, x:x + w] = strip[:h, :w]
+    
     def connect(self):
         """Connect to the video server"""
         try:
             # Create socket connection
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
             self.socket.connect((self.server_host, self.server_port))
+            # Send each frame immediately instead of waiting on Nagle
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             print(f"✅ Connected to server at {self.server_host}:{self.server_port}")
             return True
         except Exception as e:
@@ -45,6 +109,8 @@ class VideoClient:
             self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
             self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
             self.cap.set(cv2.CAP_PROP_FPS, 30)
+            # Keep only the newest frame queued in the driver
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
             
             print(f"📷 Camera {self.camera_index} initialized")
             return True
@@ -55,23 +121,76 @@ class VideoClient:
     def send_frame(self, frame):
         """Send a single frame to the server"""
         try:
-            # Encode frame as JPEG
-            _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            frame_data = buffer.tobytes()
-            
-            # Send frame size first (4 bytes)
-            frame_size = len(frame_data)
-            size_data = struct.pack('!I', frame_size)
-            self.socket.sendall(size_data)
-            
-            # Send frame data
-            self.socket.sendall(frame_data)
-            
+            self.send_payload(self.encode_frame(frame))
             return True
         except Exception as e:
             print(f"❌ Frame sending error: {e}")
             return False
     
+    def encode_frame(self, frame):
+        """Encode a frame as JPEG and return the payload as a memoryview"""
+        frame = self.resize_frame(frame)
+        
+        # Encode frame as JPEG (memoryview avoids copying into bytes)
+        if self.tj is not None:
+            frame_mv = memoryview(self.tj.encode(frame, quality=self.jpeg_quality,
+                                                 pixel_format=TJPF_BGR,
+                                                 jpeg_subsample=TJSAMP_420))
+        else:
+            _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            frame_mv = buffer.reshape(-1).data
+        
+        return frame_mv
+    
+    def resize_frame(self, frame):
+        """Scale a frame down to the configured send size"""
+        if (frame.shape[1], frame.shape[0]) == self.frame_size:
+            return frame
+        # INTER_AREA is both the cheapest and cleanest filter for downscaling
+        return cv2.resize(frame, self.frame_size, interpolation=cv2.INTER_AREA)
+    
+    def send_payload(self, payload):
+        """Send frame size (4 bytes) and frame data in a single syscall"""
+        FRAME_HEADER.pack_into(self.header_buf, 0, len(payload))
+        self.send_buffers(self.header_buf, payload)
+    
+    def send_buffers(self, header, payload):
+        """Send header and payload with one scatter-gather write"""
+        sent = self.socket.sendmsg([header, payload])
+        
+        # sendmsg may write partially; finish the remainder with sendall
+        if sent < len(header):
+            self.socket.sendall(header[sent:])
+            sent = len(header)
+        if sent - len(header) < len(payload):
+            self.socket.sendall(payload[sent - len(header):])
+    
+    def send_loop(self, frame_queue):
+        """Sender thread: write encoded frames until the None sentinel"""
+        while True:
+            payload = frame_queue.get()
+            if payload is None:
+                break
+            
+            try:
+                self.send_payload(payload)
+            except Exception as e:
+                print(f"❌ Frame sending error: {e}")
+                self.running = False
+                break
+    
+    @staticmethod
+    def put_latest(frame_queue, item):
+        """Queue an item, dropping the oldest one if the sender is behind"""
+        try:
+            frame_queue.put_nowait(item)
+        except queue.Full:
+            try:
+                frame_queue.get_nowait()
+            except queue.Empty:
+                pass
+            frame_queue.put_nowait(item)
+    
     def stream_video(self):
         """Main video streaming loop"""
         if not self.connect():
@@ -81,60 +200,116 @@ class VideoClient:
             return
         
         print("🎬 Starting video stream...")
-        print("Press 'q' to quit")
+        print("Press Ctrl+C to quit")
         
         self.running = True
         frame_count = 0
         start_time = time.time()
+        frame_interval = 0.033  # ~30 FPS
+        next_deadline = time.monotonic()
+        
+        # Overlay strings only change once per second
+        last_ts_sec = 0
+        timestamp_strip = None
+        frame_label_strip = self.render_text("Frame: ")
+        fps_text = ''
+        
+        # Capture + encode runs here while a separate thread sends, so the
+        # two stages overlap. A small queue drops frames under back-pressure.
+        frame_queue = queue.Queue(maxsize=2)
+        sender_thread = threading.Thread(target=self.send_loop, args=(frame_queue,))
+        sender_thread.daemon = True
+        sender_thread.start()
+        
+        # Stop the loop cleanly on Ctrl+C (signal handlers can only be
+        # installed from the main thread); restored on exit
+        previous_sigint = None
+        if threading.current_thread() is threading.main_thread():
+            previous_sigint = signal.signal(
+                signal.SIGINT, lambda signum, frame: self.request_stop())
         
         try:
             while self.running:
-                # Capture frame
-                ret, frame = self.cap.read()
+                # Grab frames without decoding until the next send is due
+                if not self.cap.grab():
+                    print("⚠️ Failed to capture frame")
+                    break
+                
+                now = time.monotonic()
+                if now < next_deadline:
+                    continue
+                
+                # Schedule from the deadline to avoid drift; resync if we fell behind
+                next_deadline += frame_interval
+                if next_deadline < now:
+                    next_deadline = now + frame_interval
+                
+                # Decode only the frame we are going to send
+                ret, frame = self.cap.retrieve()
                 if not ret:
                     print("⚠️ Failed to capture frame")
                     break
                 
+                # Scale down before drawing overlays so text stays legible
+                frame = self.resize_frame(frame)
+                
+                # Refresh timestamp and FPS text once per second
+                now_sec = int(time.time())
+                if now_sec != last_ts_sec:
+                    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now_sec))
+                    timestamp_strip = self.render_text(timestamp)
+                    elapsed_time = now_sec - start_time
+                    if elapsed_time > 0:
+                        fps_text = f"FPS: {frame_count / elapsed_time:.1f}"
+                    last_ts_sec = now_sec
+                
                 # Add timestamp overlay
-                timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-                cv2.putText(frame, timestamp, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 
-                           0.7, (0, 255, 0), 2)
+                self.draw_text(frame, timestamp_strip, 10, 30)
                 
                 # Add frame counter
-                cv2.putText(frame, f"Frame: {frame_count}", (10, 60), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+                self.draw_text(frame, frame_label_strip, 10, 60)
+                self.draw_text(frame, self.render_text(str(frame_count)),
+                               10 + frame_label_strip.shape[1], 60)
                 
-                # Send frame to server
-                if not self.send_frame(frame):
-                    print("❌ Failed to send frame")
-                    break
+                # Encode and hand off to the sender thread
+                self.put_latest(frame_queue, self.encode_frame(frame))
                 
                 frame_count += 1
                 
-                # Calculate and display FPS
-                elapsed_time = time.time() - start_time
-                if elapsed_time > 0:
-                    fps = frame_count / elapsed_time
-                    cv2.putText(frame, f"FPS: {fps:.1f}", (10, 90), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+                # Report FPS periodically
+                if fps_text and frame_count % 100 == 0:
+                    print(f"📊 {fps_text}")
                 
                 # Display local preview (optional)
-                cv2.imshow('Video Client', frame)
-                
-                # Check for quit key
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
-                
-                # Small delay to control frame rate
-                time.sleep(0.033)  # ~30 FPS
+                if self.show_preview:
+                    if fps_text:
+                        cv2.putText(frame, fps_text, (10, 90), 
+                                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+                    cv2.imshow('Video Client', frame)
+                    
+                    # Check for quit key
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        break
                 
         except KeyboardInterrupt:
             print("\n🛑 Interrupted by user")
         except Exception as e:
             print(f"❌ Streaming error: {e}")
         finally:
+            if previous_sigint is not None:
+                signal.signal(signal.SIGINT, previous_sigint)
+            
+            # Stop the sender before closing its socket
+            self.put_latest(frame_queue, None)
+            sender_thread.join(timeout=1.0)
             self.stop()
     
+    def request_stop(self):
+        """Ask the streaming loop to exit after the current frame"""
+        if self.running:
+            print("\n🛑 Interrupted by user")
+        self.running = False
+    
     def stop(self):
         """Stop the video client"""
         self.running = False
@@ -145,7 +320,8 @@ class VideoClient:
         if self.socket:
             self.socket.close()
         
-        cv2.destroyAllWindows()
+        if self.show_preview:
+            cv2.destroyAllWindows()
         print("🛑 Video client stopped")
 
 
@@ -2,37 +2,111 @@ import socket
 import cv2
 import numpy as np
 import threading
-import time
+from collections import deque
 import base64
-from flask import Flask, render_template_string, Response
+import asyncio
+from string import Template
+from aiohttp import web, WSCloseCode
 import io
 from PIL import Image
 import struct
 
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420
+except ImportError:
+    TurboJPEG = None
+
+try:
+    import torch
+    from torchvision.io import decode_jpeg as nv_decode_jpeg, encode_jpeg as nv_encode_jpeg
+except ImportError:
+    torch = None
+
+# Frame size prefix sent ahead of every JPEG payload
+FRAME_HEADER = struct.Struct('!I')
+
+# Upper bound on a frame's declared size; larger headers are treated as
+# corrupt and the connection is dropped rather than allocating the buffer
+MAX_FRAME_SIZE = 16 << 20
+
+# Explicit socket buffer size (~1 MB) so several frames fit in flight
+SOCKET_BUFFER_SIZE = 1 << 20
+
+# Decoder batching: wait for up to this many clients' frames, for at most
+# this long (the window only applies on the GPU, where batches pay off)
+DECODE_BATCH_SIZE = 32
+DECODE_BATCH_WINDOW = 0.005
+
+# Consecutive nvJPEG failures on frames the CPU decodes fine before the GPU
+# decoder is given up on (corrupt input fails on both and is not counted)
+CUDA_DECODE_FAILURE_LIMIT = 3
+
+# Multipart boundary + headers preceding each MJPEG frame
+MJPEG_PART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+
 class VideoServer:
     def __init__(self, host='0.0.0.0', port=8080, web_port=5000):
         """
-        Initialize the video server with TCP socket and Flask web interface
+        Initialize the video server with TCP socket and aiohttp web interface
         
         Args:
             host (str): Host address for TCP server
             port (int): Port for TCP video stream
-            web_port (int): Port for Flask web dashboard
+            web_port (int): Port for web dashboard
         """
         self.host = host
         self.port = port
         self.web_port = web_port
-        self.current_frame = None
-        self.frame_lock = threading.Lock()
+        # Latest (jpeg_bytes, decoded_frame) pair; the raw JPEG payload is served
+        # as-is to viewers. Replacing the single slot is atomic under the GIL, so
+        # readers never take a lock.
+        self.latest = deque([(None, None)], maxlen=1)
+        self.frames_received = 0
+        self.viewers = 0
+        # Newest undecoded jpeg_bytes per client address, taken in batches by one
+        # decoder thread; a newer frame overwrites a stale one instead of queueing
+        # behind it. jpeg_bytes of None marks a disconnect.
+        self.pending_frames = {}
+        self.frames_pending = threading.Condition()
+        # Set (and replaced) on the event loop whenever a new frame or a
+        # disconnect is published, waking every MJPEG viewer at once
+        self.loop = None
+        self.frame_event = None
+        # Open status WebSockets, closed on shutdown; closing releases MJPEG viewers
+        self.status_sockets = set()
+        self.closing = False
         self.running = False
         self.server_socket = None
         
-        # Initialize Flask app for web dashboard
-        self.app = Flask(__name__)
-        self.setup_flask_routes()
+        # libjpeg-turbo codec (falls back to OpenCV when unavailable)
+        self.tj = None
+        if TurboJPEG is not None:
+            try:
+                self.tj = TurboJPEG()
+            except (OSError, RuntimeError) as e:
+                print(f"⚠️ libjpeg-turbo unavailable, using OpenCV codec: {e}")
         
-    def setup_flask_routes(self):
-        """Setup Flask routes for web dashboard"""
+        # nvJPEG on the GPU takes priority when CUDA is present
+        self.use_cuda = torch is not None and torch.cuda.is_available()
+        self.cuda_decode_failures = 0
+        if self.use_cuda:
+            print("🚀 CUDA available, using nvJPEG codec")
+        
+        # Placeholder shown when no client is streaming, built once as a
+        # complete multipart chunk
+        placeholder = np.zeros((480, 640, 3), dtype=np.uint8)
+        cv2.putText(placeholder, 'No Video Stream', (150, 240), 
+                  cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        self.placeholder_part = MJPEG_PART_HEADER + self.encode_jpeg(placeholder) + b'\r\n'
+        
+        # Initialize aiohttp app for web dashboard
+        self.app = web.Application()
+        self.app.on_startup.append(self.on_web_startup)
+        self.app.on_shutdown.append(self.on_web_shutdown)
+        self.setup_web_routes()
+        
+    def setup_web_routes(self):
+        """Setup aiohttp routes for web dashboard"""
         
         # HTML template for the video dashboard
         html_template = """
@@ -131,8 +205,8 @@ class VideoServer:
                 
                 <div class="status">
                     <h3>Server Status</h3>
-                    <p>TCP Server: <span id="tcpStatus">Running on {{ host }}:{{ port }}</span></p>
-                    <p>Web Dashboard: <span id="webStatus">Running on {{ web_host }}:{{ web_port }}</span></p>
+                    <p>TCP Server: <span id="tcpStatus">Running on $host:$port</span></p>
+                    <p>Web Dashboard: <span id="webStatus">Running on $web_host:$web_port</span></p>
                 </div>
                 
                 <div class="stats">
@@ -157,32 +231,6 @@ class VideoServer:
             </div>
             
             <script>
-                let frameCount = 0;
-                let lastTime = Date.now();
-                let fps = 0;
-                
-                // Update FPS counter
-                function updateStats() {
-                    frameCount++;
-                    const now = Date.now();
-                    const delta = now - lastTime;
-                    
-                    if (delta >= 1000) {
-                        fps = Math.round((frameCount * 1000) / delta);
-                        document.getElementById('fpsCounter').textContent = fps;
-                        document.getElementById('frameCounter').textContent = frameCount;
-                        frameCount = 0;
-                        lastTime = now;
-                    }
-                }
-                
-                // Update video feed
-                function updateVideo() {
-                    const img = document.getElementById('videoFeed');
-                    img.src = '/video_feed?' + new Date().getTime();
-                    updateStats();
-                }
-                
                 // Refresh page
                 function refreshPage() {
                     location.reload();
@@ -200,73 +248,286 @@ class VideoServer:
                     }
                 }
                 
-                // Auto-refresh video feed
-                setInterval(updateVideo, 33); // ~30 FPS
+                // Update stats from a status push
+                function updateStatus(data) {
+                    document.getElementById('connectionStatus').textContent = 
+                        data.connected ? 'Connected' : 'Disconnected';
+                    document.getElementById('fpsCounter').textContent = data.fps;
+                    document.getElementById('frameCounter').textContent = data.frames;
+                }
                 
-                // Check connection status
-                setInterval(() => {
-                    fetch('/status')
-                        .then(response => response.json())
-                        .then(data => {
-                            document.getElementById('connectionStatus').textContent = 
-                                data.connected ? 'Connected' : 'Disconnected';
-                        })
-                        .catch(() => {
-                            document.getElementById('connectionStatus').textContent = 'Error';
-                        });
-                }, 1000);
+                // Receive status changes pushed by the server
+                function connectStatus() {
+                    const scheme = location.protocol === 'https:' ? 'wss://' : 'ws://';
+                    const ws = new WebSocket(scheme + location.host + '/ws/status');
+                    ws.onmessage = e => updateStatus(JSON.parse(e.data));
+                    ws.onclose = () => {
+                        document.getElementById('connectionStatus').textContent = 'Error';
+                        setTimeout(connectStatus, 1000);
+                    };
+                }
+                connectStatus();
             </script>
         </body>
         </html>
         """
         
-        @self.app.route('/')
-        def dashboard():
+        # The page has no per-request state, so render it once
+        dashboard_html = Template(html_template).substitute(
+            host=self.host,
+            port=self.port,
+            web_host='localhost',
+            web_port=self.web_port
+        )
+        
+        async def dashboard(request):
             """Main dashboard page"""
-            return render_template_string(
-                html_template,
-                host=self.host,
-                port=self.port,
-                web_host='localhost',
-                web_port=self.web_port
-            )
+            return web.Response(text=dashboard_html, content_type='text/html')
         
-        @self.app.route('/video_feed')
-        def video_feed():
+        async def video_feed(request):
             """Stream video frames as MJPEG"""
-            def generate():
-                while True:
-                    with self.frame_lock:
-                        if self.current_frame is not None:
-                            # Convert frame to JPEG
-                            _, buffer = cv2.imencode('.jpg', self.current_frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                            frame_bytes = buffer.tobytes()
-                            
-                            yield (b'--frame\r\n'
-                                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                        else:
-                            # Send placeholder frame if no video
-                            placeholder = np.zeros((480, 640, 3), dtype=np.uint8)
-                            cv2.putText(placeholder, 'No Video Stream', (150, 240), 
-                                      cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-                            _, buffer = cv2.imencode('.jpg', placeholder)
-                            frame_bytes = buffer.tobytes()
-                            
-                            yield (b'--frame\r\n'
-                                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+            response = web.StreamResponse(
+                headers={'Content-Type': 'multipart/x-mixed-replace; boundary=frame'})
+            await response.prepare(request)
+            
+            self.viewers += 1
+            try:
+                while not self.closing:
+                    # Grab the event before reading the slot so no frame is missed
+                    event = self.frame_event
+                    frame_bytes, _ = self.latest[0]
+                    
+                    # The client already sends JPEG, so no re-encode is needed
+                    if frame_bytes is not None:
+                        await response.write(MJPEG_PART_HEADER + frame_bytes + b'\r\n')
+                    else:
+                        # Send placeholder frame if no video
+                        await response.write(self.placeholder_part)
                     
-                    time.sleep(0.033)  # ~30 FPS
+                    # Sleep until a new frame is published instead of polling
+                    if not await self.wait_for_frame(event, request):
+                        break
+            except ConnectionResetError:
+                pass
+            finally:
+                self.viewers -= 1
             
-            return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+            return response
         
-        @self.app.route('/status')
-        def status():
+        async def status(request):
             """Return server status as JSON"""
-            return {
-                'connected': self.current_frame is not None,
+            return web.json_response({
+                'connected': self.latest[0][1] is not None,
+                'frames': self.frames_received,
+                'viewers': self.viewers,
                 'tcp_port': self.port,
                 'web_port': self.web_port
-            }
+            })
+        
+        async def status_ws(request):
+            """Push connection/FPS status to the dashboard when it changes"""
+            ws = web.WebSocketResponse()
+            await ws.prepare(request)
+            self.status_sockets.add(ws)
+            
+            async def read_until_closed():
+                # The dashboard never sends; reading is what processes its
+                # close frame, so ws.closed turns True when the tab goes away
+                async for _ in ws:
+                    pass
+            
+            reader = asyncio.ensure_future(read_until_closed())
+            loop = asyncio.get_running_loop()
+            last_state = None
+            window_start = loop.time()
+            window_frames = self.frames_received
+            fps = 0
+            frames = window_frames
+            
+            try:
+                while not reader.done() and not ws.closed and not self.closing:
+                    event = self.frame_event
+                    
+                    # Roll the FPS/frame counters once per second
+                    now = loop.time()
+                    if now - window_start >= 1.0:
+                        frames = self.frames_received
+                        fps = round((frames - window_frames) / (now - window_start))
+                        window_start, window_frames = now, frames
+                    
+                    state = {
+                        'connected': self.latest[0][1] is not None,
+                        'fps': fps,
+                        'frames': frames
+                    }
+                    if state != last_state:
+                        await ws.send_json(state)
+                        last_state = state
+                    
+                    # Woken by frames/disconnects; the timeout lets the counters roll over
+                    try:
+                        await asyncio.wait_for(event.wait(), timeout=1.0)
+                    except asyncio.TimeoutError:
+                        pass
+            except ConnectionResetError:
+                pass
+            finally:
+                reader.cancel()
+                self.status_sockets.discard(ws)
+            
+            return ws
+        
+        self.app.router.add_get('/', dashboard)
+        self.app.router.add_get('/video_feed', video_feed)
+        self.app.router.add_get('/status', status)
+        self.app.router.add_get('/ws/status', status_ws)
+    
+    async def on_web_startup(self, app):
+        """Bind frame notifications to the web server's event loop"""
+        self.loop = asyncio.get_running_loop()
+        self.frame_event = asyncio.Event()
+    
+    async def on_web_shutdown(self, app):
+        """Release open viewers so shutdown does not wait out their streams"""
+        self.closing = True
+        for ws in list(self.status_sockets):
+            await ws.close(code=WSCloseCode.GOING_AWAY, message=b'Server shutdown')
+        self.wake_viewers()
+    
+    async def wait_for_frame(self, event, request):
+        """Wait for the next frame; False if the viewer left or the server is closing"""
+        while not self.closing:
+            try:
+                await asyncio.wait_for(event.wait(), timeout=1.0)
+                return True
+            except asyncio.TimeoutError:
+                # No frames arriving, so check the viewer is still there
+                transport = request.transport
+                if transport is None or transport.is_closing():
+                    return False
+        return False
+    
+    def wake_viewers(self):
+        """Wake all waiting MJPEG viewers (runs on the event loop)"""
+        self.frame_event.set()
+        self.frame_event = asyncio.Event()
+    
+    def notify_viewers(self):
+        """Schedule a viewer wakeup from the TCP receiver thread"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wake_viewers)
+    
+    def encode_jpeg(self, frame, quality=85):
+        """Encode a BGR frame to JPEG bytes"""
+        if self.use_cuda:
+            try:
+                # HWC BGR -> CHW RGB on the GPU
+                tensor = torch.from_numpy(frame).to('cuda').permute(2, 0, 1).flip(0)
+                return nv_encode_jpeg(tensor, quality=quality).cpu().numpy().tobytes()
+            except RuntimeError as e:
+                print(f"⚠️ nvJPEG encode failed, falling back to CPU: {e}")
+                self.use_cuda = False
+        if self.tj is not None:
+            return self.tj.encode(frame, quality=quality, pixel_format=TJPF_BGR,
+                                  jpeg_subsample=TJSAMP_420)
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return buffer.tobytes()
+    
+    def decode_jpeg(self, frame_data):
+        """Decode JPEG bytes to a BGR frame"""
+        if self.use_cuda:
+            try:
+                data = torch.frombuffer(frame_data, dtype=torch.uint8)
+                frame = self.gpu_to_bgr(nv_decode_jpeg(data, device='cuda'))
+                self.cuda_decode_failures = 0
+                return frame
+            except RuntimeError as e:
+                # Corrupt input also lands here; decode this frame on the CPU
+                # (raising again if it really is corrupt)
+                frame = self.decode_jpeg_cpu(frame_data)
+                if frame is not None:
+                    self.cuda_decode_failures += 1
+                    if self.cuda_decode_failures >= CUDA_DECODE_FAILURE_LIMIT:
+                        print(f"⚠️ nvJPEG decode keeps failing, falling back to CPU: {e}")
+                        self.use_cuda = False
+                return frame
+        return self.decode_jpeg_cpu(frame_data)
+    
+    def decode_jpeg_cpu(self, frame_data):
+        """Decode JPEG bytes to a BGR frame with libjpeg-turbo or OpenCV"""
+        if self.tj is not None:
+            return self.tj.decode(frame_data, pixel_format=TJPF_BGR)
+        # Convert bytes to numpy array
+        nparr = np.frombuffer(frame_data, np.uint8)
+        return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    
+    @staticmethod
+    def gpu_to_bgr(image):
+        """Convert a decoded CHW RGB GPU tensor to an HWC BGR host array"""
+        return image.flip(0).permute(1, 2, 0).contiguous().cpu().numpy()
+    
+    def decode_batch(self, jpegs):
+        """Decode several JPEGs, in one nvJPEG batch call when on the GPU"""
+        if self.use_cuda and len(jpegs) > 1:
+            try:
+                data = [torch.frombuffer(jpeg, dtype=torch.uint8) for jpeg in jpegs]
+                return [self.gpu_to_bgr(image) for image in nv_decode_jpeg(data, device='cuda')]
+            except RuntimeError as e:
+                print(f"⚠️ nvJPEG batch decode failed, decoding frames individually: {e}")
+        
+        frames = []
+        for jpeg in jpegs:
+            try:
+                frames.append(self.decode_jpeg(jpeg))
+            except Exception as e:
+                print(f"❌ Frame decoding error: {e}")
+                frames.append(None)
+        return frames
+    
+    def put_pending_frame(self, client_address, frame_data):
+        """Replace a client's undecoded frame and wake the decoder"""
+        with self.frames_pending:
+            self.pending_frames[client_address] = frame_data
+            self.frames_pending.notify()
+    
+    def next_decode_batch(self):
+        """Block until frames are pending, then take every client's newest one"""
+        with self.frames_pending:
+            self.frames_pending.wait_for(lambda: self.pending_frames)
+            if self.use_cuda:
+                self.frames_pending.wait_for(
+                    lambda: len(self.pending_frames) >= DECODE_BATCH_SIZE,
+                    timeout=DECODE_BATCH_WINDOW)
+            batch, self.pending_frames = self.pending_frames, {}
+        return batch
+    
+    def decode_loop(self):
+        """Decode received frames in batches and publish them to viewers"""
+        while True:
+            # Frames superseded before the decoder got to them were already
+            # overwritten, so each client contributes at most one frame
+            newest = self.next_decode_batch()
+            
+            pending = [(addr, data) for addr, data in newest.items() if data is not None]
+            decoded = dict(zip((addr for addr, _ in pending),
+                               self.decode_batch([data for _, data in pending])))
+            
+            for client_address, frame_data in newest.items():
+                if frame_data is None:
+                    # Clear current frame when client disconnects
+                    self.latest.append((None, None))
+                    self.notify_viewers()
+                    continue
+                
+                frame = decoded[client_address]
+                if frame is not None:
+                    # Publish the new frame, then wake viewers
+                    self.latest.append((frame_data, frame))
+                    self.notify_viewers()
+                    
+                    print(f"📹 Received frame: {frame.shape[1]}x{frame.shape[0]} from {client_address}")
+                else:
+                    print(f"⚠️ Failed to decode frame from {client_address}")
     
     def start_tcp_server(self):
         """Start the TCP server to receive video frames"""
@@ -274,6 +535,8 @@ class VideoServer:
             # Create TCP socket
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            # Set before listen() so accepted sockets inherit it with window scaling
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
             self.server_socket.bind((self.host, self.port))
             self.server_socket.listen(5)
             
@@ -307,43 +570,49 @@ class VideoServer:
             if self.server_socket:
                 self.server_socket.close()
     
+    @staticmethod
+    def recv_exact(client_socket, view):
+        """Fill view from the socket; returns the number of bytes received"""
+        received = 0
+        while received < len(view):
+            n = client_socket.recv_into(view[received:], len(view) - received)
+            if not n:
+                break
+            received += n
+        return received
+    
     def handle_client(self, client_socket, client_address):
         """Handle individual client connection and video stream"""
+        # Reused buffer for the size header
+        size_data = bytearray(FRAME_HEADER.size)
+        size_view = memoryview(size_data)
+        # TCP_QUICKACK is Linux-only and not sticky, so it is re-armed per frame
+        quickack = hasattr(socket, 'TCP_QUICKACK')
         try:
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            
             while self.running:
+                if quickack:
+                    # ACK immediately rather than waiting for delayed ACK
+                    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+                
                 # Receive frame size (4 bytes)
-                size_data = client_socket.recv(4)
-                if not size_data:
+                if self.recv_exact(client_socket, size_view) < FRAME_HEADER.size:
                     break
                 
-                frame_size = struct.unpack('!I', size_data)[0]
+                frame_size, = FRAME_HEADER.unpack_from(size_data)
+                if frame_size > MAX_FRAME_SIZE:
+                    print(f"⚠️ Oversized frame ({frame_size} bytes) from {client_address}, dropping connection")
+                    break
                 
-                # Receive frame data
-                frame_data = b''
-                while len(frame_data) < frame_size:
-                    chunk = client_socket.recv(min(frame_size - len(frame_data), 4096))
-                    if not chunk:
-                        break
-                    frame_data += chunk
+                # Receive frame data straight into a preallocated buffer
+                frame_data = bytearray(frame_size)
+                received = self.recv_exact(client_socket, memoryview(frame_data))
                 
-                if len(frame_data) == frame_size:
-                    # Decode JPEG frame
-                    try:
-                        # Convert bytes to numpy array
-                        nparr = np.frombuffer(frame_data, np.uint8)
-                        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                        
-                        if frame is not None:
-                            # Update current frame with thread safety
-                            with self.frame_lock:
-                                self.current_frame = frame
-                            
-                            print(f"📹 Received frame: {frame.shape[1]}x{frame.shape[0]} from {client_address}")
-                        else:
-                            print(f"⚠️ Failed to decode frame from {client_address}")
-                            
-                    except Exception as e:
-                        print(f"❌ Frame decoding error: {e}")
+                if received == frame_size:
+                    # Hand off to the decoder thread
+                    self.frames_received += 1
+                    self.put_pending_frame(client_address, frame_data)
                 else:
                     print(f"⚠️ Incomplete frame received from {client_address}")
                     
@@ -353,15 +622,14 @@ class VideoServer:
             print(f"🔌 Client {client_address} disconnected")
             client_socket.close()
             
-            # Clear current frame when client disconnects
-            with self.frame_lock:
-                self.current_frame = None
+            # Overwrites any undecoded frame so the clear lands last
+            self.put_pending_frame(client_address, None)
     
     def start_web_server(self):
-        """Start the Flask web server"""
+        """Start the aiohttp web server"""
         try:
             print(f"🌐 Web Dashboard started on http://localhost:{self.web_port}")
-            self.app.run(host='0.0.0.0', port=self.web_port, debug=False, threaded=True)
+            web.run_app(self.app, host='0.0.0.0', port=self.web_port, print=None)
         except Exception as e:
             print(f"❌ Failed to start web server: {e}")
     
@@ -372,8 +640,14 @@ class VideoServer:
         tcp_thread.daemon = True
         tcp_thread.start()
         
-        # Start web server in main thread
+        # Start frame decoder in separate thread
+        decode_thread = threading.Thread(target=self.decode_loop)
+        decode_thread.daemon = True
+        decode_thread.start()
+        
+        # Start web server in main thread (returns on Ctrl+C)
         self.start_web_server()
+        self.stop()
     
     def stop(self):
         """Stop the server"""
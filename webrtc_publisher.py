@@ -1,11 +1,16 @@
 import argparse
 import asyncio
+import fractions
 import json
 import logging
 import cv2
 
 from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack
+from aiortc import rtcrtpsender
+from aiortc.rtcrtpsender import RTCRtpSender
+from aiortc.codecs.h264 import H264Encoder, MAX_FRAME_RATE
 from aiortc.contrib.media import MediaBlackhole
+import av
 from av import VideoFrame
 import numpy as np
 import aiohttp
@@ -13,6 +18,87 @@ import aiohttp
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("webrtc_publisher")
 
+# Hardware H264 encoders to try, in order of preference, with low-latency options.
+# aiortc requests keyframes (first frame, PLI/FIR) by setting pict_type = I;
+# nvenc only turns those into IDRs with forced-idr. Without a global header
+# both encoders emit SPS/PPS in-band ahead of every IDR (nvenc sets
+# repeatSPSPPS, FFmpeg's v4l2m2m wrapper enables REPEAT_SEQ_HEADER itself),
+# so late-joining viewers can start decoding from the next keyframe.
+HW_H264_ENCODERS = {
+    "h264_nvenc": {
+        "preset": "p1", "tune": "ll", "zerolatency": "1", "profile": "baseline",
+        "forced-idr": "1",
+    },
+    "h264_v4l2m2m": {},
+}
+
+def create_hw_encoder_context(name: str, width: int, height: int, bitrate: int) -> av.CodecContext:
+    codec = av.CodecContext.create(name, "w")
+    codec.width = width
+    codec.height = height
+    codec.bit_rate = bitrate
+    codec.pix_fmt = "yuv420p"
+    codec.framerate = fractions.Fraction(MAX_FRAME_RATE, 1)
+    codec.time_base = fractions.Fraction(1, MAX_FRAME_RATE)
+    codec.options = HW_H264_ENCODERS[name]
+    # Opening fails here if the device/driver is missing
+    codec.open()
+    return codec
+
+class HardwareH264Encoder(H264Encoder):
+    """aiortc H264 encoder that opens a hardware codec context when available.
+
+    aiortc's own encoder only builds a context when ``self.codec`` is None, so
+    pre-seeding it here swaps the codec while reusing aiortc's packetization.
+    Falls back to the stock libx264 path if no hardware encoder opens.
+
+    This overrides aiortc's private ``_encode_frame`` and mirrors its reset
+    rule and buffering attributes (``codec_buffering``, ``buffer_pts``);
+    checked against aiortc 1.9.0. Re-check when upgrading aiortc.
+    """
+
+    def _encode_frame(self, frame, force_keyframe):
+        # Same reset rule as aiortc, applied first so a reopened context is
+        # also hardware-backed
+        if self.codec and (
+            frame.width != self.codec.width
+            or frame.height != self.codec.height
+            or abs(self.target_bitrate - self.codec.bit_rate) / self.codec.bit_rate > 0.1
+        ):
+            self.buffer_data = b""
+            self.buffer_pts = None
+            self.codec = None
+
+        if self.codec is None:
+            for name in HW_H264_ENCODERS:
+                try:
+                    self.codec = create_hw_encoder_context(
+                        name, frame.width, frame.height, bitrate=self.target_bitrate
+                    )
+                    self.codec_buffering = False
+                    logger.info("Using hardware H264 encoder: %s", name)
+                    break
+                except Exception as exc:
+                    logger.debug("H264 encoder %s unavailable: %s", name, exc)
+        return super()._encode_frame(frame, force_keyframe)
+
+def use_hardware_h264_encoder():
+    """Route aiortc's H264 sender encoding through HardwareH264Encoder.
+
+    Safe to call more than once; the patch is only installed the first time.
+    """
+    get_encoder = rtcrtpsender.get_encoder
+    if getattr(get_encoder, "hardware_h264", False):
+        return
+
+    def get_hw_encoder(codec):
+        if codec.mimeType.lower() == "video/h264":
+            return HardwareH264Encoder()
+        return get_encoder(codec)
+
+    get_hw_encoder.hardware_h264 = True
+    rtcrtpsender.get_encoder = get_hw_encoder
+
 class OpenCVCaptureTrack(MediaStreamTrack):
     kind = "video"
 
@@ -23,36 +109,50 @@ class OpenCVCaptureTrack(MediaStreamTrack):
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
         self.cap.set(cv2.CAP_PROP_FPS, fps)
         self.target_frame_time = 1.0 / float(fps)
+        self.width = width
+        self.height = height
+
+        # Reused output frame; the sender encodes each frame before the next recv().
+        # BGR goes straight to av, the encoder's yuv420p conversion reads it directly.
+        self.av_frame = VideoFrame(width, height, "bgr24")
+        plane = self.av_frame.planes[0]
+        # (height, width, 3) view aliasing the plane, skipping any row padding
+        self.plane_view = (
+            np.frombuffer(plane, dtype=np.uint8)
+            .reshape(height, plane.line_size)[:, : width * 3]
+            .reshape(height, width, 3)
+        )
 
     async def recv(self) -> VideoFrame:
         pts, time_base = await self.next_timestamp()
-        ok, frame = self.cap.read()
+        # OpenCV decodes in place when the plane view matches the capture size
+        ok, frame = self.cap.read(self.plane_view)
         if not ok or frame is None:
             # fallback to black frame
-            frame = np.zeros((360, 640, 3), dtype=np.uint8)
-        # BGR to RGB for av
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        av_frame = VideoFrame.from_ndarray(frame, format="rgb24")
-        av_frame.pts = pts
-        av_frame.time_base = time_base
-        return av_frame
+            self.plane_view[:] = 0
+        elif frame is not self.plane_view:
+            # cv2 hands back the same array object when it wrote in place
+            if frame.shape == self.plane_view.shape:
+                np.copyto(self.plane_view, frame)
+            else:
+                self.plane_view[:] = cv2.resize(frame, (self.width, self.height))
+        self.av_frame.pts = pts
+        self.av_frame.time_base = time_base
+        return self.av_frame
 
 async def publish(server_url: str):
+    use_hardware_h264_encoder()
     pc = RTCPeerConnection()
 
     # Add video track from OpenCV
     video = OpenCVCaptureTrack()
-    sender = pc.addTrack(video)
+    transceiver = pc.addTransceiver(video, direction="sendonly")
 
-    # Prefer H264 if available
-    try:
-        from aiortc.rtcrtpsender import RTCRtpSender
-        caps = RTCRtpSender.getCapabilities("video")
-        h264_codecs = [c for c in caps.codecs if c.mimeType == "video/H264"]
-        if h264_codecs:
-            sender.setCodecPreferences(h264_codecs)
-    except Exception as exc:
-        logger.warning("Codec preference set failed: %s", exc)
+    # Prefer H264 if available (codec preferences live on the transceiver)
+    caps = RTCRtpSender.getCapabilities("video")
+    h264_codecs = [c for c in caps.codecs if c.mimeType == "video/H264"]
+    if h264_codecs:
+        transceiver.setCodecPreferences(h264_codecs)
 
     # Create offer
     offer = await pc.createOffer()
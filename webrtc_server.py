@@ -1,24 +1,79 @@
 import asyncio
 import json
 import logging
+import os
 from typing import Optional
 
-from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack
+import msgspec
+from aiortc import (
+    InvalidAccessError,
+    InvalidStateError,
+    MediaStreamTrack,
+    RTCConfiguration,
+    RTCIceGatherer,
+    RTCPeerConnection,
+    RTCSessionDescription,
+)
 from aiortc.contrib.media import MediaRelay
-from flask import Flask, request, jsonify, render_template_string
+from aiortc.rtcrtpsender import RTCRtpSender
+import uvicorn
+from quart import Quart, request
 
-logging.basicConfig(level=logging.INFO)
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import uvloop
+except ImportError:  # e.g. Windows
+    uvloop = None
+
+# Quiet by default in production; LOG_LEVEL=INFO restores handshake logging
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
 logger = logging.getLogger("webrtc_server")
 
-app = Flask(__name__)
+app = Quart(__name__)
 relay = MediaRelay()
 
 # Shared relayed track from the current publisher
 publisher_track: Optional[MediaStreamTrack] = None
+publisher_lock = asyncio.Lock()
+# Set while publisher_track is available; viewers wait on it briefly
+publisher_ready = asyncio.Event()
+PUBLISHER_WAIT_TIMEOUT = 5.0
 
-# Keep references to connections to avoid GC
+# Keep references to connections to avoid GC; entries are dropped once a
+# connection reaches a terminal state (see close_pc)
 active_pcs: set[RTCPeerConnection] = set()
 
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+class SessionDescriptionMessage(msgspec.Struct):
+    """SDP offer/answer as exchanged with publishers and viewers."""
+    sdp: str
+    type: str
+
+# Decoder reads straight into a typed struct, validating fields in the same pass
+OFFER_DECODER = msgspec.json.Decoder(SessionDescriptionMessage)
+JSON_ENCODER = msgspec.json.Encoder()
+
+NO_PUBLISHER_JSON = JSON_ENCODER.encode({"error": "no publisher"})
+BAD_OFFER_JSON = JSON_ENCODER.encode({"error": "invalid offer"})
+
+# One peer connection configuration shared by every handshake (aiortc's
+# default STUN server, resolved once)
+PC_CONFIG = RTCConfiguration(iceServers=RTCIceGatherer.getDefaultIceServers())
+
+# Viewer codec preferences, resolved once instead of on every handshake:
+# H264 first, then aiortc's other video codecs (and RTX) so browsers without
+# H264 still negotiate
+VIDEO_CAPABILITIES = RTCRtpSender.getCapabilities("video").codecs
+H264_CODECS = tuple(c for c in VIDEO_CAPABILITIES if c.mimeType == "video/H264")
+VIDEO_CODEC_PREFERENCES = H264_CODECS + tuple(
+    c for c in VIDEO_CAPABILITIES if c.mimeType != "video/H264"
+)
+
 INDEX_HTML = """
 <!doctype html>
 <html>
@@ -41,7 +96,7 @@ INDEX_HTML = """
 <body>
   <div class="container">
     <h1>WebRTC H264 Viewer</h1>
-    <p class="tag">This page receives H264 video from the Python publisher via the Flask+aiortc server.</p>
+    <p class="tag">This page receives H264 video from the Python publisher via the Quart+aiortc server.</p>
     <div class="card">
       <video id="video" playsinline autoplay></video>
       <div class="row">
@@ -80,6 +135,14 @@ INDEX_HTML = """
         body: JSON.stringify({ sdp: pc.localDescription.sdp, type: pc.localDescription.type })
       });
 
+      if (res.status === 503) {
+        // No publisher yet; retry until one connects
+        pc.close();
+        status.textContent = 'Waiting for publisher...';
+        setTimeout(() => start().catch(err => { status.textContent = 'Error: ' + err; }), 2000);
+        return;
+      }
+
       if (!res.ok) {
         status.textContent = 'Server error creating answer';
         return;
@@ -101,9 +164,78 @@ INDEX_HTML = """
 </html>
 """
 
+# The page has no template variables, so the response is built once,
+# along with a Brotli-compressed variant for clients that accept it
+INDEX_BYTES = INDEX_HTML.encode("utf-8")
+INDEX_HEADERS = {
+    "Content-Type": "text/html; charset=utf-8",
+    "Content-Length": str(len(INDEX_BYTES)),
+    "Cache-Control": "public, max-age=3600",
+    "Vary": "Accept-Encoding",
+}
+INDEX_BR = brotli.compress(INDEX_BYTES, quality=11) if brotli is not None else None
+INDEX_BR_HEADERS = {
+    **INDEX_HEADERS,
+    "Content-Encoding": "br",
+    "Content-Length": str(len(INDEX_BR or b"")),
+}
+
+# aiortc has no "disconnected" connection state; these are final
+TERMINAL_PC_STATES = ("failed", "closed")
+
+async def close_pc(pc: RTCPeerConnection) -> None:
+    """Close a peer connection and release the server's reference to it."""
+    await pc.close()
+    active_pcs.discard(pc)
+
+async def release_publisher_track(track: Optional[MediaStreamTrack]) -> None:
+    """Forget the relayed publisher track if it is still the current one."""
+    global publisher_track
+    async with publisher_lock:
+        if track is not None and publisher_track is track:
+            publisher_track = None
+            publisher_ready.clear()
+
+def parse_offer(body: bytes) -> Optional[RTCSessionDescription]:
+    """Parse a signaling request body, or None if it is not a valid offer.
+
+    Called before any RTCPeerConnection is built so bad input fails fast.
+    """
+    try:
+        message = OFFER_DECODER.decode(body)
+    except msgspec.DecodeError:
+        return None
+    # Both endpoints only answer; other description types cannot be applied
+    if message.type != "offer":
+        return None
+    return RTCSessionDescription(sdp=message.sdp, type=message.type)
+
+async def answer_offer(pc: RTCPeerConnection, offer: RTCSessionDescription) -> bool:
+    """Apply a remote offer and set the local answer.
+
+    Returns False if aiortc rejects the offer. The connection is closed on any
+    failure, since it would otherwise never reach a terminal state.
+    """
+    try:
+        await pc.setRemoteDescription(offer)
+        answer = await pc.createAnswer()
+        await pc.setLocalDescription(answer)
+    except (ValueError, InvalidAccessError, InvalidStateError) as exc:
+        logger.info("Rejected offer: %s", exc)
+        await close_pc(pc)
+        return False
+    except Exception:
+        await close_pc(pc)
+        raise
+    return True
+
 @app.route("/")
-def index():
-    return render_template_string(INDEX_HTML)
+async def index():
+    if INDEX_BR is not None:
+        encodings = request.headers.get("Accept-Encoding", "")
+        if "br" in (e.split(";")[0].strip() for e in encodings.split(",")):
+            return INDEX_BR, 200, INDEX_BR_HEADERS
+    return INDEX_BYTES, 200, INDEX_HEADERS
 
 @app.route("/publish", methods=["POST"])
 async def publish():
@@ -111,76 +243,138 @@ async def publish():
     Returns the SDP answer with no transceivers added (server receives only).
     The incoming video track is relayed for viewers.
     """
-    global publisher_track
+    offer = parse_offer(await request.get_data())
+    if offer is None:
+        return BAD_OFFER_JSON, 400, JSON_HEADERS
 
-    params = await request.get_json(force=True)
-    offer = RTCSessionDescription(sdp=params["sdp"], type=params["type"])
-
-    pc = RTCPeerConnection()
+    pc = RTCPeerConnection(configuration=PC_CONFIG)
     active_pcs.add(pc)
+    # Relayed track published through this connection, if any
+    relayed: Optional[MediaStreamTrack] = None
 
     @pc.on("track")
-    def on_track(track: MediaStreamTrack):
-        nonlocal publisher_track
+    async def on_track(track: MediaStreamTrack):
+        global publisher_track
+        nonlocal relayed
         logger.info("Publisher track received: %s", track.kind)
         if track.kind == "video":
-            publisher_track = relay.subscribe(track)
+            # Unbuffered: each viewer gets only the newest frame. A slow viewer
+            # drops frames instead of growing a per-subscriber queue (and latency).
+            relayed = relay.subscribe(track, buffered=False)
+            async with publisher_lock:
+                # A reconnecting publisher replaces the old relay subscription
+                if publisher_track is not None:
+                    publisher_track.stop()
+                publisher_track = relayed
+                publisher_ready.set()
 
         @track.on("ended")
         async def on_ended():
             logger.info("Publisher track ended")
+            await release_publisher_track(relayed)
 
-    await pc.setRemoteDescription(offer)
+    @pc.on("connectionstatechange")
+    async def on_state_change():
+        logger.info("Publisher connection state: %s", pc.connectionState)
+        if pc.connectionState in TERMINAL_PC_STATES:
+            await close_pc(pc)
+            await release_publisher_track(relayed)
 
     # Server receives only; create answer
-    answer = await pc.createAnswer()
-    await pc.setLocalDescription(answer)
+    if not await answer_offer(pc, offer):
+        return BAD_OFFER_JSON, 400, JSON_HEADERS
 
-    logger.info("Publisher connected. PCs=%d", len(active_pcs))
-    return jsonify({"sdp": pc.localDescription.sdp, "type": pc.localDescription.type})
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Publisher connected. PCs=%d", len(active_pcs))
+    answer_json = JSON_ENCODER.encode(
+        SessionDescriptionMessage(sdp=pc.localDescription.sdp, type=pc.localDescription.type)
+    )
+    return answer_json, 200, JSON_HEADERS
 
 @app.route("/viewer", methods=["POST"])
 async def viewer():
     """Endpoint for the browser viewer to POST its SDP offer.
-    The server responds with an answer containing the relayed video track if present.
+    The server responds with an answer containing the relayed video track.
+    If no publisher is connected, it waits briefly for one and then gives up
+    with 503 without building a peer connection.
     """
-    params = await request.get_json(force=True)
-    offer = RTCSessionDescription(sdp=params["sdp"], type=params["type"])
+    if publisher_track is None:
+        try:
+            await asyncio.wait_for(publisher_ready.wait(), timeout=PUBLISHER_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            return NO_PUBLISHER_JSON, 503, JSON_HEADERS
+
+    offer = parse_offer(await request.get_data())
+    if offer is None:
+        return BAD_OFFER_JSON, 400, JSON_HEADERS
+
+    # The publisher may have gone away while the body was read
+    track = publisher_track
+    if track is None:
+        return NO_PUBLISHER_JSON, 503, JSON_HEADERS
 
-    pc = RTCPeerConnection()
+    pc = RTCPeerConnection(configuration=PC_CONFIG)
     active_pcs.add(pc)
 
-    # If we have a relayed publisher track, add it for viewing
-    if publisher_track is not None:
-        sender = pc.addTrack(publisher_track)
-        # Prefer H264 when possible
-        try:
-            from aiortc.rtcrtpsender import RTCRtpSender
-            caps = RTCRtpSender.getCapabilities("video")
-            h264_codecs = [c for c in caps.codecs if c.mimeType == "video/H264"]
-            if h264_codecs:
-                sender.setCodecPreferences(h264_codecs)
-        except Exception as exc:
-            logger.warning("Codec preference set failed: %s", exc)
-
-    @pc.on("iceconnectionstatechange")
-    def on_state_change():
-        logger.info("Viewer ICE state: %s", pc.iceConnectionState)
-        if pc.iceConnectionState in ("failed", "closed", "disconnected"):
-            active_pcs.discard(pc)
-
-    await pc.setRemoteDescription(offer)
-    answer = await pc.createAnswer()
-    await pc.setLocalDescription(answer)
-
-    logger.info("Viewer connected. PCs=%d", len(active_pcs))
-    return jsonify({"sdp": pc.localDescription.sdp, "type": pc.localDescription.type})
-
-@app.route("/health")
-def health() -> tuple[str, int]:
-    return "ok", 200
+    sender = pc.addTrack(track)
+    try:
+        # Prefer H264 when possible; preferences live on the transceiver and
+        # must be set before the offer is applied
+        transceiver = next(t for t in pc.getTransceivers() if t.sender is sender)
+        transceiver.setCodecPreferences(list(VIDEO_CODEC_PREFERENCES))
+    except Exception:
+        await close_pc(pc)
+        raise
+
+    @pc.on("connectionstatechange")
+    async def on_state_change():
+        logger.info("Viewer connection state: %s", pc.connectionState)
+        if pc.connectionState in TERMINAL_PC_STATES:
+            await close_pc(pc)
+
+    if not await answer_offer(pc, offer):
+        return BAD_OFFER_JSON, 400, JSON_HEADERS
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Viewer connected. PCs=%d", len(active_pcs))
+    answer_json = JSON_ENCODER.encode(
+        SessionDescriptionMessage(sdp=pc.localDescription.sdp, type=pc.localDescription.type)
+    )
+    return answer_json, 200, JSON_HEADERS
+
+HEALTH_RESPONSE_START = {
+    "type": "http.response.start",
+    "status": 200,
+    "headers": [(b"content-type", b"text/plain"), (b"content-length", b"2")],
+}
+HEALTH_RESPONSE_BODY = {"type": "http.response.body", "body": b"ok"}
+
+async def health(scope, receive, send) -> None:
+    """Raw ASGI /health: a constant response without Quart's request pipeline."""
+    await send(HEALTH_RESPONSE_START)
+    await send(HEALTH_RESPONSE_BODY)
+
+quart_asgi_app = app.asgi_app
+
+async def asgi_app(scope, receive, send) -> None:
+    if scope["type"] == "http" and scope["path"] == "/health":
+        await health(scope, receive, send)
+    else:
+        await quart_asgi_app(scope, receive, send)
+
+# Quart.__call__ dispatches through app.asgi_app, so /health bypasses the framework
+app.asgi_app = asgi_app
 
 if __name__ == "__main__":
-    # Use asyncio.run to ensure proper event loop for Flask async views (requires Flask>=2.0)
-    # Run Flask development server
-    app.run(host="0.0.0.0", port=5000, debug=False, threaded=True)
+    # Serve the ASGI app on a single event loop shared with aiortc. One worker
+    # only: publisher_track and active_pcs are process-global. Put a reverse
+    # proxy in front for TLS and keep-alive.
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=5000,
+        workers=1,
+        # uvloop's socket I/O and timer dispatch is faster for aiortc's RTP/RTCP work
+        loop="uvloop" if uvloop is not None else "asyncio",
+        http="httptools",
+    )